@@ -0,0 +1,208 @@
+# Classic Game Resource Reader (CGRR): Parse resources from classic games.
+# Copyright (C) 2016  Tracy Poff
+#
+# This file is part of CGRR.
+#
+# CGRR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CGRR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CGRR.  If not, see <http://www.gnu.org/licenses/>.
+"""Benchmarks for the Pokemon Red/Blue/Yellow save parser.
+
+Run with:
+
+    python -m pokemon.benchmark [--output results.json] [--baseline old.json]
+
+Saves are generated from a seeded random number generator, so no real save
+files are needed and results are comparable between runs.
+
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import struct
+import sys
+import timeit
+
+from . import pokemon_rby as pr
+from .common import Pokemon, PokemonType, Move, Item
+
+name_chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz '
+species = sorted(set(n for n in pr.species_index.values() if n))
+moves = [m for m in Move if m.value <= 165]
+items = [i for i in Item if i.value < 256]
+
+
+def synthetic_name(r):
+    return ''.join(r.choice(name_chars) for _ in range(r.randint(1, 10)))
+
+
+def synthetic_pokemon(r, full=False):
+    p = {
+        'species': Pokemon(r.choice(species)),
+        'current_hp': r.randint(1, 999),
+        'level_in_box': r.randint(1, 100),
+        'status_condition': r.choice([[], [pr.Status.ASLEEP], [pr.Status.PARALYZED]]),
+        'type_1': r.choice(list(PokemonType)),
+        'type_2': r.choice(list(PokemonType)),
+        'catch_rate': r.randint(0, 255),
+        'original_trainer_id': r.randint(0, 65535),
+        'experience_points': r.randint(0, 2**24 - 1),
+        'iv': {k: r.randint(0, 15) for k in ('attack', 'defense', 'speed', 'special')},
+        'name': synthetic_name(r),
+        'ot_name': synthetic_name(r),
+    }
+    for i in range(1, 5):
+        p['move_{}'.format(i)] = r.choice(moves + [None])
+        p['move_{}_pp'.format(i)] = r.randint(0, 40)
+    for stat in ('hp', 'attack', 'defense', 'speed', 'special'):
+        p[stat + '_ev'] = r.randint(0, 65535)
+    if full:
+        for stat in ('level', 'maximum_hp', 'attack', 'defense', 'speed', 'special'):
+            p[stat] = r.randint(1, 100)
+    return p
+
+
+def synthetic_save(seed=0, box_count=20):
+    """Return the bytes of a plausible save with full boxes and team."""
+    r = random.Random(seed)
+    s = {}
+    for key, fmt in pr.save_file_reader.format.items():
+        if key.startswith('unknown'):
+            s[key] = bytes(r.randrange(256) for _ in range(struct.calcsize(fmt)))
+    s.update({
+        'player_name': synthetic_name(r),
+        'rival_name': synthetic_name(r),
+        'pokedex_owned': {Pokemon(i + 1): r.random() < 0.5 for i in range(152)},
+        'pokedex_seen': {Pokemon(i + 1): r.random() < 0.5 for i in range(152)},
+        'pocket_item_list': [{'item': r.choice(items), 'count': r.randint(1, 99)}
+                             for _ in range(20)],
+        'pc_item_list': [{'item': r.choice(items), 'count': r.randint(1, 99)}
+                         for _ in range(50)],
+        'money': r.randint(0, 999999),
+        'casino_coins': r.randint(0, 9999),
+        'options': {
+            'battle_effects': True,
+            'battle_style': pr.BattleStyle.BATTLE_STYLE_SWITCH,
+            'sound': pr.Sound.SOUND_MONO,
+            'text_speed': pr.TextSpeed.TEXT_SPEED_NORMAL,
+        },
+        'badges': [b for b in pr.Badge if r.random() < 0.5],
+        'player_trainer_id': r.randint(0, 65535),
+        'pikachu_friendship': r.randint(0, 255),
+        'current_pc_box': {'top_bit': 0, 'current_box': r.randint(1, 12)},
+        'time_played': datetime.timedelta(hours=r.randint(0, 255),
+                                          minutes=r.randint(0, 59),
+                                          seconds=r.randint(0, 59)),
+        'team_pokemon': {'pokemon': [synthetic_pokemon(r, True) for _ in range(6)]},
+        'current_box_pokemon': {'pokemon': [synthetic_pokemon(r) for _ in range(box_count)]},
+        'checksum': 0,
+    })
+    for i in range(1, 13):
+        s['pc_box_{}'.format(i)] = {'pokemon': [synthetic_pokemon(r) for _ in range(box_count)]}
+    return pr.unparse_rby_us_save(s)
+
+
+def region(data, key):
+    offset, st = pr.save_file_fields[key]
+    return data[offset:offset + st.size]
+
+
+def benchmarks(data):
+    """Return a dict of benchmark name -> zero-argument callable."""
+    save = pr.parse_rby_us_save(data)
+    name = region(data, 'player_name')
+    return {
+        'parse_rby_us_save': lambda: pr.parse_rby_us_save(data),
+        'parse_rby_us_save_lazy_metadata': lambda: [
+            pr.parse_rby_us_save(data, lazy=True)[k]
+            for k in ('player_name', 'player_trainer_id', 'time_played')],
+        'unparse_rby_us_save': lambda: pr.unparse_rby_us_save(save),
+        'parse_pc_box_pokemon': lambda: pr.parse_pc_box_pokemon(region(data, 'pc_box_1')),
+        'parse_team_pokemon': lambda: pr.parse_team_pokemon(region(data, 'team_pokemon')),
+        'parse_pokedex_list': lambda: pr.parse_pokedex_list(region(data, 'pokedex_owned')),
+        'parse_item_list': lambda: pr.parse_item_list(region(data, 'pc_item_list')),
+        'sniff_rby_us_save': lambda: pr.sniff_rby_us_save(data),
+        'verify_rby_us_checksums': lambda: pr.verify_rby_us_checksums(data),
+        'diff_rby_us_saves_unchanged': lambda: pr.diff_rby_us_saves(data, bytes(data)),
+        'rby_us_string_decode': lambda: pr.rby_us_string_decode(name),
+        'rby_us_string_encode': lambda: pr.rby_us_string_encode(save['player_name'], 11),
+    }
+
+
+def run(repeat=5, min_time=0.2, names=None, seed=0):
+    """Time each benchmark, returning the best seconds per call for each."""
+    results = {}
+    for name, func in sorted(benchmarks(synthetic_save(seed)).items()):
+        if names and name not in names:
+            continue
+        timer = timeit.Timer(func)
+        number, elapsed = timer.autorange()
+        number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+        results[name] = min(timer.repeat(repeat, number)) / number
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return (name, baseline, current, ratio, regressed) rows."""
+    rows = []
+    for name, current in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ratio = current / baseline[name]
+        rows.append((name, baseline[name], current, ratio, ratio > 1 + tolerance))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="JSON results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="fractional slowdown counted as a regression (default 0.1)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help="approximate seconds per repetition")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('benchmark', nargs='*', help="only run these benchmarks")
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat, args.min_time, args.benchmark, args.seed)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressed = False
+        for name, old, new, ratio, slower in compare(results, baseline, args.tolerance):
+            regressed = regressed or slower
+            print("{:<36} {:>12.3f}us {:>12.3f}us {:>7.2f}x{}".format(
+                name, old * 1e6, new * 1e6, ratio, "  REGRESSION" if slower else ""),
+                file=sys.stderr)
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -17,8 +17,24 @@
 # along with CGRR.  If not, see <http://www.gnu.org/licenses/>.
 """Parses Pokemon Red/Blue/Yellow files."""
 
+import codecs
+import collections
 import struct
 import datetime
+import functools
+import itertools
+import mmap
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict, namedtuple
+from concurrent import futures
+
+try:
+    from collections.abc import MutableMapping, MutableSet
+except ImportError:
+    from collections import MutableMapping, MutableSet
 
 try:
     from enum import IntEnum
@@ -35,6 +51,10 @@ title = "Pokémon Red Version (US)"
 developer = "Game Freak, Inc."
 description = "Pokémon Red Version (US)"
 
+# Increase this whenever the decoded form of a save changes, so that stored
+# results (see pokemon_rby_cache) are not reused.
+format_version = 1
+
 species_index = {
     1: 112, 2: 115, 3: 32, 4: 35, 5: 21,
     6: 100, 7: 34,  8: 80, 9: 2,  10: 103,
@@ -76,31 +96,157 @@ species_index = {
     186: 44, 187: 45, 188: 69, 189: 70, 190: 71,
 }
 
+# Pokedex number -> internal index, keeping the first index for each number.
+species_index_reverse = {}
+for i, n in sorted(species_index.items()):
+    species_index_reverse.setdefault(n, i)
+del i, n
 
-def rby_us_string_decode(b):
-    return b.decode('pokemon_rby_us').split('\u0003')[0]
 
+def field_offsets(reader):
+    """Map each field of reader to its (offset, struct.Struct) in the data."""
+    offsets = OrderedDict()
+    position = 0
+    for name, fmt in reader.format.items():
+        st = struct.Struct(reader.byte_order + fmt)
+        offsets[name] = (position, st)
+        position += st.size
+    return offsets
 
-def rby_us_string_encode(s, max_len):
-    b = s.encode('pokemon_rby_us')
-    if len(b) < max_len:
-        b += '\u0003'.encode('pokemon_rby_us')
-    b += bytes(max_len - len(b))
-    return b
 
+def unpack_field(reader, fields, view, key):
+    """Unpack and massage a single field from a memoryview.
+
+    String fields are passed to massage_in as slices of view, so no copy is
+    made unless the massage function makes one.
+
+    """
+    offset, st = fields[key]
+    if st.format[-1] == 's':
+        value = view[offset:offset + st.size]
+    else:
+        value = st.unpack_from(view, offset)[0]
+    if key in reader.massage_in:
+        value = reader.massage_in[key](value)
+    return value
+
+
+def unpack_view(reader, fields, data):
+    """Like reader.unpack, but without copying string fields."""
+    view = memoryview(data)
+    if len(view) != reader.struct.size:
+        raise struct.error("unpack requires a buffer of {} bytes".format(
+            reader.struct.size))
+    return {key: unpack_field(reader, fields, view, key) for key in fields}
+
+
+def rby_us_string_decode(b, table=pokemon_rby_us.decoding_table):
+    # Only the bytes before the terminator (0x50) are decoded.
+    b = bytes(b)
+    end = b.find(0x50)
+    if end != -1:
+        b = b[:end]
+    return codecs.charmap_decode(b, 'strict', table)[0]
+
+
+def rby_us_string_list_decode(b, max_len, table=pokemon_rby_us.decoding_table):
+    s = codecs.charmap_decode(bytes(b), 'strict', table)[0]
+    return [s[i:i + max_len].partition('\u0003')[0] for i in range(0, len(s), max_len)]
 
-def rby_us_string_list_encode(l, max_len):
-    b = b''
-    for s in l:
-        b += rby_us_string_encode(s, max_len)
-    return b
+
+def rby_us_string_encode_into(b, offset, s, max_len, table=pokemon_rby_us.encoding_table):
+    """Encode s into b[offset:offset + max_len], which must be zeroed."""
+    e = codecs.charmap_encode(s, 'strict', table)[0]
+    if len(e) > max_len:
+        raise ValueError("{!r} is longer than {} bytes".format(s, max_len))
+    b[offset:offset + len(e)] = e
+    if len(e) < max_len:
+        b[offset + len(e)] = 0x50
+
+
+def rby_us_string_encode(s, max_len, table=pokemon_rby_us.encoding_table):
+    b = bytearray(max_len)
+    rby_us_string_encode_into(b, 0, s, max_len, table)
+    return bytes(b)
+
+
+def rby_us_string_list_encode(l, max_len, table=pokemon_rby_us.encoding_table):
+    b = bytearray(len(l) * max_len)
+    for i, s in enumerate(l):
+        rby_us_string_encode_into(b, i * max_len, s, max_len, table)
+    return bytes(b)
 
 
 def parse_pokedex_list(b):
     return {Pokemon(i+1): bool((b[i//8] >> (i % 8)) & 1) for i in range(len(b)*8)}
 
 
+# Long enough for the 32-byte Pokedex of Gold/Silver/Crystal as well.
+pokedex_order = tuple(Pokemon(i + 1) for i in range(32*8))
+
+
+class Pokedex(MutableSet):
+    """The set of Pokemon flagged in a Pokedex bitfield.
+
+    Membership, counting (len) and iteration work on the raw bytes, so no
+    enum values are built unless they are iterated over.
+
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data=bytes(19)):
+        self.data = bytearray(data)
+
+    def _bit(self, p):
+        # Only ints (Pokemon included), as a set of Pokemon would never
+        # contain '151' or 151.9.
+        if not isinstance(p, int):
+            raise TypeError("{!r} is not a Pokemon".format(p))
+        i = int(p) - 1
+        if not 0 <= i < len(self.data)*8:
+            raise ValueError("{!r} is not in the Pokedex".format(p))
+        return i // 8, 1 << (i % 8)
+
+    def __contains__(self, p):
+        try:
+            byte, mask = self._bit(p)
+        except (TypeError, ValueError):
+            return False
+        return bool(self.data[byte] & mask)
+
+    def __iter__(self):
+        n = int.from_bytes(self.data, 'little')
+        while n:
+            low = n & -n
+            yield pokedex_order[low.bit_length() - 1]
+            n ^= low
+
+    def __len__(self):
+        return bin(int.from_bytes(self.data, 'little')).count('1')
+
+    def add(self, p):
+        byte, mask = self._bit(p)
+        self.data[byte] |= mask
+
+    def discard(self, p):
+        # Like set.discard, anything which can't be in the Pokedex is ignored.
+        try:
+            byte, mask = self._bit(p)
+        except (TypeError, ValueError):
+            return
+        self.data[byte] &= ~mask
+
+    def to_dict(self):
+        """Return the dict returned by parse_pokedex_list."""
+        return parse_pokedex_list(self.data)
+
+    def __repr__(self):
+        return "Pokedex({!r})".format(sorted(self))
+
+
 def unparse_pokedex_list(d):
+    if isinstance(d, Pokedex):
+        return bytes(d.data)
     size = len(d)//8
     b = b''
     for i in range(size):
@@ -274,7 +420,10 @@ def species_to_enum(i):
 
 
 def enum_to_species(e):
-    return list(species_index.keys())[list(species_index.values()).index(e.value)]
+    try:
+        return species_index_reverse[e.value]
+    except KeyError:
+        raise ValueError("{!r} has no internal index".format(e))
 
 
 class Status(IntEnum):
@@ -285,6 +434,178 @@ class Status(IntEnum):
     PARALYZED = 0x40
 
 
+def enum_table(enum):
+    """Return a 256-entry tuple mapping each byte to its enum member or None."""
+    members = {e.value: e for e in enum}
+    return tuple(members.get(i) for i in range(256))
+
+
+pokemon_type_table = enum_table(PokemonType)
+move_table = enum_table(Move)
+status_table = tuple(tuple(st for st in Status if st.value & i) for i in range(256))
+
+
+class PokemonRecord(MutableMapping):
+    """A compact view of one Pokemon over its raw record bytes.
+
+    Fields are decoded when accessed, by key or as attributes, and re-encoded
+    into the record when assigned. Changing a decoded list or dict in place
+    does not change the record; assign the new value instead.
+
+    """
+    __slots__ = ('data', 'name', 'ot_name')
+    reader = None
+    fields = None
+
+    def __init__(self, data, name, ot_name):
+        self.data = bytes(data)
+        self.name = name
+        self.ot_name = ot_name
+
+    def __getitem__(self, key):
+        if key == 'name':
+            return self.name
+        if key == 'ot_name':
+            return self.ot_name
+        if key not in self.fields:
+            raise KeyError(key)
+        return unpack_field(self.reader, self.fields, memoryview(self.data), key)
+
+    def __getattr__(self, key):
+        if key.startswith('_') or key not in self.fields:
+            raise AttributeError(key)
+        return self[key]
+
+    def __setitem__(self, key, value):
+        if key in ('name', 'ot_name'):
+            setattr(self, key, value)
+        elif key in self.fields:
+            if key in self.reader.massage_out:
+                value = self.reader.massage_out[key](value)
+            offset, st = self.fields[key]
+            b = bytearray(self.data)
+            st.pack_into(b, offset, value)
+            self.data = bytes(b)
+        else:
+            raise KeyError(key)
+
+    def __delitem__(self, key):
+        raise TypeError("fields cannot be removed from a Pokemon record")
+
+    def __iter__(self):
+        for key in self.fields:
+            yield key
+        yield 'name'
+        yield 'ot_name'
+
+    def __len__(self):
+        return len(self.fields) + 2
+
+    def __repr__(self):
+        return "{}({!r})".format(type(self).__name__, dict(self))
+
+
+def pack_pokemon(reader, p):
+    if isinstance(p, PokemonRecord) and p.reader is reader:
+        return p.data
+    return reader.pack(p)
+
+
+class LRUCache(object):
+    """A bounded mapping which discards the least recently used entries."""
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+# Decoded PC boxes and Pokemon, keyed by their raw bytes. None unless
+# memoize() has been called.
+record_cache = None
+
+
+def memoize(maxsize=65536):
+    """Reuse decoded PC boxes and Pokemon whose raw bytes have been seen before.
+
+    Up to maxsize entries are kept; memoize(0) turns memoization off again.
+    Callers always get their own copy, so changing a result does not change
+    the cache.
+
+    """
+    global record_cache
+    record_cache = LRUCache(maxsize) if maxsize else None
+    return record_cache
+
+
+def copy_pokemon(p):
+    if isinstance(p, PokemonRecord):
+        return type(p)(p.data, p.name, p.ot_name)
+    p = dict(p)
+    p['status_condition'] = list(p['status_condition'])
+    p['iv'] = dict(p['iv'])
+    return p
+
+
+def copy_pokemon_list(d):
+    d = dict(d)
+    for key in ('species', 'ot_names', 'names'):
+        d[key] = list(d[key])
+    d['pokemon'] = [copy_pokemon(p) for p in d['pokemon']]
+    return d
+
+
+def parse_pokemon(reader, fields, b):
+    """Decode one Pokemon record, using the record cache if there is one."""
+    cache = record_cache
+    if cache is None:
+        return unpack_view(reader, fields, b)
+    key = (reader.struct.size, bytes(b))
+    p = cache.get(key)
+    if p is None:
+        p = unpack_view(reader, fields, b)
+        cache.put(key, p)
+    return copy_pokemon(p)
+
+
+def parse_type(i):
+    return pokemon_type_table[i]
+
+
+def parse_move(i):
+    return move_table[i]
+
+
+def parse_status(s):
+    return list(status_table[s])
+
+
 pokemon_full_reader = FileReader(
     format=[
         ("species", "B"),
@@ -319,18 +640,18 @@ pokemon_full_reader = FileReader(
     ],
     massage_in={
         'species': lambda i: Pokemon(species_index[i]),
-        'status_condition': lambda s: [st for st in Status if (st.value & s)],
-        'type_1': lambda i: PokemonType(i) if i in [e.value for e in PokemonType] else None,
-        'type_2': lambda i: PokemonType(i) if i in [e.value for e in PokemonType] else None,
-        'move_1': lambda i: Move(i) if i in [e.value for e in Move] else None,
-        'move_2': lambda i: Move(i) if i in [e.value for e in Move] else None,
-        'move_3': lambda i: Move(i) if i in [e.value for e in Move] else None,
-        'move_4': lambda i: Move(i) if i in [e.value for e in Move] else None,
+        'status_condition': parse_status,
+        'type_1': parse_type,
+        'type_2': parse_type,
+        'move_1': parse_move,
+        'move_2': parse_move,
+        'move_3': parse_move,
+        'move_4': parse_move,
         'experience_points': lambda b: (b[0] << 16) + (b[1] << 8) + b[2],
         'iv': parse_iv,
     },
     massage_out={
-        'species': lambda e: list(species_index.keys())[list(species_index.values()).index(e.value)],
+        'species': enum_to_species,
         'status_condition': lambda s: sum(st.value for st in s),
         'type_1': lambda t: t.value if t else 0,
         'type_2': lambda t: t.value if t else 0,
@@ -344,6 +665,15 @@ pokemon_full_reader = FileReader(
     byte_order=">"
 )
 
+pokemon_full_fields = field_offsets(pokemon_full_reader)
+
+
+class FullPokemonRecord(PokemonRecord):
+    __slots__ = ()
+    reader = pokemon_full_reader
+    fields = pokemon_full_fields
+
+
 team_pokemon_reader = FileReader(
     format=[
         ("count", "B"),
@@ -354,8 +684,8 @@ team_pokemon_reader = FileReader(
     ],
     massage_in={
         'species':  parse_species,
-        'ot_names': (lambda s: [rby_us_string_decode(s[i*11:(i+1)*11]) for i in range(6)]),
-        'names':    (lambda s: [rby_us_string_decode(s[i*11:(i+1)*11]) for i in range(6)]),
+        'ot_names': (lambda s: rby_us_string_list_decode(s, 11)),
+        'names':    (lambda s: rby_us_string_list_decode(s, 11)),
     },
     massage_out={
         'species':  unparse_species,
@@ -366,10 +696,18 @@ team_pokemon_reader = FileReader(
 )
 
 
-def parse_team_pokemon(b):
+team_pokemon_fields = field_offsets(team_pokemon_reader)
+
+
+def parse_team_pokemon(b, compact=False):
     size = 44
-    d = team_pokemon_reader.unpack(b)
-    d['pokemon'] = [pokemon_full_reader.unpack(d['pokemon'][size*i:size*(i+1)]) for i in range(d['count'])]
+    d = unpack_view(team_pokemon_reader, team_pokemon_fields, b)
+    if compact:
+        d['pokemon'] = [FullPokemonRecord(d['pokemon'][size*i:size*(i+1)], d['names'][i], d['ot_names'][i])
+                        for i in range(d['count'])]
+        return d
+    d['pokemon'] = [parse_pokemon(pokemon_full_reader, pokemon_full_fields, d['pokemon'][size*i:size*(i+1)])
+                    for i in range(d['count'])]
     for i in range(d['count']):
         d['pokemon'][i]['name'] = d['names'][i]
         d['pokemon'][i]['ot_name'] = d['ot_names'][i]
@@ -386,7 +724,7 @@ def unparse_team_pokemon(d):
     d['ot_names'] = [d['pokemon'][i]['ot_name'] for i in range(d['count'])]
     d['species'] = [d['pokemon'][i]['species'] for i in range(d['count'])]
     for p in d['pokemon']:
-        b += pokemon_full_reader.pack(p)
+        b += pack_pokemon(pokemon_full_reader, p)
     b += bytes(264-len(b))
     d['pokemon'] = b
     return team_pokemon_reader.pack(d)
@@ -420,18 +758,18 @@ pokemon_brief_reader = FileReader(
     ],
     massage_in={
         'species':           (lambda i: Pokemon(species_index[i])),
-        'status_condition':  (lambda s: [st for st in Status if (st.value & s)]),
-        'type_1':            (lambda i: PokemonType(i) if i in [e.value for e in PokemonType] else None),
-        'type_2':            (lambda i: PokemonType(i) if i in [e.value for e in PokemonType] else None),
-        'move_1':            (lambda i: Move(i) if i in [e.value for e in Move] else None),
-        'move_2':            (lambda i: Move(i) if i in [e.value for e in Move] else None),
-        'move_3':            (lambda i: Move(i) if i in [e.value for e in Move] else None),
-        'move_4':            (lambda i: Move(i) if i in [e.value for e in Move] else None),
+        'status_condition':  parse_status,
+        'type_1':            parse_type,
+        'type_2':            parse_type,
+        'move_1':            parse_move,
+        'move_2':            parse_move,
+        'move_3':            parse_move,
+        'move_4':            parse_move,
         'experience_points': (lambda b: (b[0] << 16) + (b[1] << 8) + b[2]),
         'iv':                parse_iv,
     },
     massage_out={
-        'species':           (lambda e: list(species_index.keys())[list(species_index.values()).index(e.value)]),
+        'species':           enum_to_species,
         'status_condition':  (lambda s: sum(st.value for st in s)),
         'type_1':            (lambda t: t.value if t else 0),
         'type_2':            (lambda t: t.value if t else 0),
@@ -445,6 +783,14 @@ pokemon_brief_reader = FileReader(
     byte_order=">"
 )
 
+pokemon_brief_fields = field_offsets(pokemon_brief_reader)
+
+
+class BriefPokemonRecord(PokemonRecord):
+    __slots__ = ()
+    reader = pokemon_brief_reader
+    fields = pokemon_brief_fields
+
 
 pc_box_reader = FileReader(
     format=[
@@ -456,8 +802,8 @@ pc_box_reader = FileReader(
     ],
     massage_in={
         'species': parse_species,
-        'ot_names': lambda s: [rby_us_string_decode(s[i*11:(i+1)*11]) for i in range(20)],
-        'names': lambda s: [rby_us_string_decode(s[i*11:(i+1)*11]) for i in range(20)],
+        'ot_names': lambda s: rby_us_string_list_decode(s, 11),
+        'names': lambda s: rby_us_string_list_decode(s, 11),
     },
     massage_out={
         'species': unparse_species,
@@ -468,16 +814,41 @@ pc_box_reader = FileReader(
 )
 
 
-def parse_pc_box_pokemon(b):
+pc_box_fields = field_offsets(pc_box_reader)
+
+
+def empty_pc_box():
+    return {'count': 0, 'species': [], 'pokemon': [], 'ot_names': [], 'names': []}
+
+
+def parse_pc_box_pokemon(b, compact=False):
+    if len(b) == pc_box_reader.struct.size and (b[0] == 0 or b[0] > 20):
+        return empty_pc_box()
+    cache = record_cache
+    if cache is None:
+        return _parse_pc_box_pokemon(b, compact)
+    key = ('pc_box', compact, bytes(b))
+    d = cache.get(key)
+    if d is None:
+        d = _parse_pc_box_pokemon(b, compact)
+        cache.put(key, d)
+    return copy_pokemon_list(d)
+
+
+def _parse_pc_box_pokemon(b, compact):
     size = 33
-    d = pc_box_reader.unpack(b)
+    d = unpack_view(pc_box_reader, pc_box_fields, b)
     if d['count'] > 20:
         d['count'] = 0
-    d['pokemon'] = [pokemon_brief_reader.unpack(d['pokemon'][size*i:size*(i+1)])
-                    for i in range(d['count'])]
     d['names'] = d['names'][:d['count']]
     d['ot_names'] = d['ot_names'][:d['count']]
     d['species'] = d['species'][:d['count']]
+    if compact:
+        d['pokemon'] = [BriefPokemonRecord(d['pokemon'][size*i:size*(i+1)], d['names'][i], d['ot_names'][i])
+                        for i in range(d['count'])]
+        return d
+    d['pokemon'] = [parse_pokemon(pokemon_brief_reader, pokemon_brief_fields, d['pokemon'][size*i:size*(i+1)])
+                    for i in range(d['count'])]
     for i in range(d['count']):
         d['pokemon'][i]['name'] = d['names'][i]
         d['pokemon'][i]['ot_name'] = d['ot_names'][i]
@@ -495,7 +866,7 @@ def unparse_pc_box_pokemon(d):
     d['ot_names'] = [d['pokemon'][i]['ot_name'] for i in range(d['count'])]
     d['species'] = [d['pokemon'][i]['species'] for i in range(d['count'])]
     for p in d['pokemon']:
-        b += pokemon_brief_reader.pack(p)
+        b += pack_pokemon(pokemon_brief_reader, p)
     b += bytes(1122-len(b))
     d['pokemon'] = b
     return pc_box_reader.pack(d)
@@ -545,6 +916,7 @@ save_file_reader = FileReader(
         ("unknown11", "1460s"),            # the rest of the file
     ],
     massage_in={
+        'unknown1':            bytes,
         'player_name':         rby_us_string_decode,
         'pokedex_owned':       parse_pokedex_list,
         'pokedex_seen':        parse_pokedex_list,
@@ -553,24 +925,34 @@ save_file_reader = FileReader(
         'rival_name':          rby_us_string_decode,
         'options':             parse_options,
         'badges':              parse_badges,
+        'unknown2':            bytes,
+        'unknown3':            bytes,
+        'unknown4':            bytes,
         'pc_item_list':        parse_item_list,
         'current_pc_box':      parse_current_pc_box,
+        'unknown5':            bytes,
         'casino_coins':        parse_bcd,
+        'unknown6':            bytes,
         'time_played':         parse_time_played,
+        'unknown7':            bytes,
         'team_pokemon':        parse_team_pokemon,
         'current_box_pokemon': parse_pc_box_pokemon,
+        'unknown8':            bytes,
+        'unknown9':            bytes,
         'pc_box_1':            parse_pc_box_pokemon,
         'pc_box_2':            parse_pc_box_pokemon,
         'pc_box_3':            parse_pc_box_pokemon,
         'pc_box_4':            parse_pc_box_pokemon,
         'pc_box_5':            parse_pc_box_pokemon,
         'pc_box_6':            parse_pc_box_pokemon,
+        'unknown10':           bytes,
         'pc_box_7':            parse_pc_box_pokemon,
         'pc_box_8':            parse_pc_box_pokemon,
         'pc_box_9':            parse_pc_box_pokemon,
         'pc_box_10':           parse_pc_box_pokemon,
         'pc_box_11':           parse_pc_box_pokemon,
         'pc_box_12':           parse_pc_box_pokemon,
+        'unknown11':           bytes,
     },
     massage_out={
         'player_name':         (lambda s: rby_us_string_encode(s, 11)),
@@ -603,21 +985,821 @@ save_file_reader = FileReader(
     byte_order=">"
 )
 
-def parse_rby_us_save(data):
-    return save_file_reader.unpack(data)
 
-def read_rby_us_save(path):
+
+save_file_fields = field_offsets(save_file_reader)
+
+# The same layout, but with Pokemon decoded to compact records and the
+# Pokedex to Pokedex sets.
+compact_save_file_reader = FileReader(
+    format=save_file_reader.format_def,
+    massage_in=dict(save_file_reader.massage_in),
+    massage_out=save_file_reader.massage_out,
+    byte_order=">"
+)
+for key, parse in compact_save_file_reader.massage_in.items():
+    if parse in (parse_team_pokemon, parse_pc_box_pokemon):
+        compact_save_file_reader.massage_in[key] = functools.partial(parse, compact=True)
+    elif parse is parse_pokedex_list:
+        compact_save_file_reader.massage_in[key] = Pokedex
+del key, parse
+
+
+class LazySave(MutableMapping):
+    """A save which decodes each field the first time it is accessed.
+
+    The raw data is kept, and decoded values are cached, so a LazySave can be
+    used anywhere the dict returned by save_file_reader.unpack is expected.
+
+    A LazySave can also be edited and packed again. Only assigned fields, and
+    accessed fields whose value has since been changed in place, are written
+    back; everything else is copied unchanged from the original data.
+
+    """
+    reader = save_file_reader
+    fields = save_file_fields
+
+    def __init__(self, data):
+        if len(data) != self.reader.struct.size:
+            raise struct.error("unpack requires a buffer of {} bytes".format(
+                self.reader.struct.size))
+        self.data = data
+        self._values = {}
+        self._assigned = set()
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        if key not in self.fields:
+            raise KeyError(key)
+        value = unpack_field(self.reader, self.fields, memoryview(self.data), key)
+        self._values[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._values[key] = value
+        self._assigned.add(key)
+
+    def _encode(self, key, value):
+        if key in self.reader.massage_out:
+            value = self.reader.massage_out[key](value)
+        return self.fields[key][1].pack(value)
+
+    def _changes(self):
+        view = memoryview(self.data)
+        for key, value in self._values.items():
+            if key not in self.fields:
+                continue
+            offset, st = self.fields[key]
+            encoded = self._encode(key, value)
+            if encoded == bytes(view[offset:offset + st.size]):
+                continue
+            # Re-encoding a field that was only read may still differ from
+            # the original, e.g. by zeroing bytes after a terminator. That
+            # is not a change unless the value was edited in place.
+            if key not in self._assigned:
+                fresh = unpack_field(self.reader, self.fields, view, key)
+                if encoded == self._encode(key, fresh):
+                    continue
+            yield key, offset, encoded
+
+    def dirty(self):
+        """Return the fields which pack will write back."""
+        return [key for key, offset, encoded in self._changes()]
+
+    def pack(self):
+        """Return a bytearray of the original data with dirty fields re-encoded."""
+        b = bytearray(self.data)
+        for key, offset, encoded in self._changes():
+            b[offset:offset + len(encoded)] = encoded
+        return b
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['data'] = bytes(self.data)
+        return state
+
+    def __delitem__(self, key):
+        raise TypeError("fields cannot be removed from a save")
+
+    def __contains__(self, key):
+        return key in self.fields or key in self._values
+
+    def __iter__(self):
+        for key in self.fields:
+            yield key
+        for key in self._values:
+            if key not in self.fields:
+                yield key
+
+    def __len__(self):
+        return len(self.fields) + sum(1 for k in self._values if k not in self.fields)
+
+    def __repr__(self):
+        return "<{} decoded={}>".format(type(self).__name__, sorted(self._values))
+
+
+class CompactLazySave(LazySave):
+    reader = compact_save_file_reader
+
+
+def parse_rby_us_save(data, lazy=False, compact=False):
+    if lazy:
+        return CompactLazySave(data) if compact else LazySave(data)
+    reader = compact_save_file_reader if compact else save_file_reader
+    return unpack_view(reader, save_file_fields, data)
+
+def read_rby_us_save(path, lazy=False, compact=False):
     with open(path, 'rb') as savefile:
         data = savefile.read(32768)
-    return parse_rby_us_save(data)
+    return parse_rby_us_save(data, lazy, compact)
+
+PokemonLocation = namedtuple("PokemonLocation", ["area", "box", "slot"])
+
+
+def _list_count(view, offset, fields, capacity):
+    count = view[offset + fields['count'][0]]
+    return 0 if count > capacity else count
+
+
+def _list_arrays(offset, fields, record_reader):
+    """Return (start, item size) of the records, names and OT names of a list."""
+    return ((offset + fields['pokemon'][0], record_reader.struct.size),
+            (offset + fields['names'][0], 11),
+            (offset + fields['ot_names'][0], 11))
+
+
+def _parse_slot(view, arrays, record_reader, record_fields, slot):
+    (records, size), (names, _), (ot_names, _) = arrays
+    p = parse_pokemon(record_reader, record_fields, view[records + size*slot:records + size*(slot+1)])
+    p['name'] = rby_us_string_decode(view[names + 11*slot:names + 11*(slot+1)])
+    p['ot_name'] = rby_us_string_decode(view[ot_names + 11*slot:ot_names + 11*(slot+1)])
+    return p
+
+
+def _iter_list(view, offset, fields, record_reader, record_fields, capacity):
+    arrays = _list_arrays(offset, fields, record_reader)
+    for slot in range(_list_count(view, offset, fields, capacity)):
+        yield slot, _parse_slot(view, arrays, record_reader, record_fields, slot)
+
+
+def iter_pokemon(data):
+    """Yield (PokemonLocation, pokemon) for every Pokemon in a save.
+
+    The team comes first, then the current box, then PC boxes 1-12. Each
+    Pokemon is decoded only when it is reached, so stopping early skips the
+    rest of the save. The area of a location is 'team', 'current_box' or
+    'pc_box'; box is None for the team.
+
+    """
+    view = memoryview(data)
+    if len(view) != save_file_reader.struct.size:
+        raise struct.error("unpack requires a buffer of {} bytes".format(
+            save_file_reader.struct.size))
+    offset = save_file_fields['team_pokemon'][0]
+    for slot, p in _iter_list(view, offset, team_pokemon_fields,
+                              pokemon_full_reader, pokemon_full_fields, 6):
+        yield PokemonLocation('team', None, slot), p
+    current_box = parse_current_pc_box(view[save_file_fields['current_pc_box'][0]])['current_box']
+    areas = [('current_box', current_box, 'current_box_pokemon')]
+    areas.extend(('pc_box', n, 'pc_box_{}'.format(n)) for n in range(1, 13))
+    for area, box, key in areas:
+        offset = save_file_fields[key][0]
+        for slot, p in _iter_list(view, offset, pc_box_fields,
+                                  pokemon_brief_reader, pokemon_brief_fields, 20):
+            yield PokemonLocation(area, box, slot), p
+
+
+class SaveArchive(object):
+    """Random access to a file of back-to-back saves, through mmap.
+
+    Saves are decoded directly from the mapped pages. Lazy saves and views
+    from raw() refer to the mapping; if any are still alive when the archive
+    is closed, the mapping stays open until the last of them is collected.
+
+    """
+    save_size = 32768
+
+    def __init__(self, path, lazy=False):
+        self.lazy = lazy
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._count = size // self.save_size
+
+    def __len__(self):
+        return self._count
+
+    def raw(self, n):
+        """Return a memoryview of the n-th save's data."""
+        if self._mmap is None and self._count:
+            raise ValueError("I/O operation on closed archive")
+        if n < 0:
+            n += self._count
+        if not 0 <= n < self._count:
+            raise IndexError("save index out of range")
+        start = n * self.save_size
+        return memoryview(self._mmap)[start:start + self.save_size]
+
+    def __getitem__(self, n):
+        return parse_rby_us_save(self.raw(n), self.lazy)
+
+    def __iter__(self):
+        for n in range(self._count):
+            yield self[n]
+            # The pages can be dropped once the consumer has moved on; they
+            # are read back from the file if a lazy save needs them again.
+            if hasattr(self._mmap, 'madvise'):
+                self._mmap.madvise(mmap.MADV_DONTNEED, n * self.save_size, self.save_size)
+
+    def close(self):
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Lazy saves or raw() views still export the buffer. Their
+                # memoryviews keep the mapping alive, and it is unmapped
+                # when they are collected.
+                pass
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _byte_sum(b, start, end):
+    """Return sum(b[start:end]), faster than sum for more than a few bytes."""
+    # The low half of an Adler-32 is 1 plus the byte sum modulo 65521, which
+    # is the exact sum for up to 256 bytes.
+    steps = range(start, end, 256)
+    return sum([zlib.adler32(b[i:min(i + 256, end)]) & 0xffff for i in steps]) - len(steps)
+
+
+def rby_us_checksum(b):
+    return (255 - _byte_sum(b, 0x2598, 0x3523)) & 255
+
+
+# PC boxes 1-6 and 7-12 are stored in two banks of six boxes. Each bank is
+# followed by a checksum of the whole bank and then one checksum per box.
+box_bank_offsets = (0x4000, 0x6000)
+box_size = 1122
+
+
+def rby_us_bank_checksums(b, bank):
+    """Return (offset, value) for each checksum of a box bank (0 or 1).
+
+    The bank checksum comes first, followed by those of its six boxes.
+
+    """
+    start = box_bank_offsets[bank]
+    end = start + 6 * box_size
+    view = memoryview(b)
+    sums = [_byte_sum(view, box, box + box_size) for box in range(start, end, box_size)]
+    checksums = [(end, (255 - sum(sums)) & 255)]
+    checksums.extend((end + 1 + i, (255 - total) & 255) for i, total in enumerate(sums))
+    return checksums
+
+
+def rby_us_checksums(b):
+    """Return an OrderedDict of name -> (offset, value) for every checksum in b.
+
+    The names are 'main', 'bank_1', 'bank_2' and 'pc_box_1' to 'pc_box_12'.
+
+    """
+    checksums = OrderedDict([('main', (0x3523, rby_us_checksum(b)))])
+    for bank in range(2):
+        bank_checksums = rby_us_bank_checksums(b, bank)
+        checksums['bank_{}'.format(bank + 1)] = bank_checksums[0]
+        for i, c in enumerate(bank_checksums[1:]):
+            checksums['pc_box_{}'.format(bank * 6 + i + 1)] = c
+    return checksums
+
+
+def verify_rby_us_checksums(data):
+    """Return the names of the checksums in data which do not match.
+
+    Only the checksummed bytes are read; nothing is decoded. An empty list
+    means the save is intact.
+
+    """
+    view = memoryview(data)
+    if len(view) != save_file_reader.struct.size:
+        raise struct.error("unpack requires a buffer of {} bytes".format(
+            save_file_reader.struct.size))
+    return [name for name, (offset, value) in rby_us_checksums(view).items()
+            if view[offset] != value]
+
+
+SaveCheck = namedtuple("SaveCheck", ["valid", "problems"])
+
+# Bytes which are known species indices and item numbers. Deleting them from
+# a run of bytes with bytes.translate leaves only the unknown ones.
+species_indices = bytes(i for i in range(256) if species_index.get(i))
+item_numbers = bytes(i for i in range(256) if i in Item._value2member_map_)
+# parse_species decodes every known index in a species list, even past the
+# terminator, so an index which maps to no Pokemon anywhere in it is an error.
+not_missingno = bytes(i for i in range(256) if species_index.get(i, 1) != 0)
+
+
+# Matches a run of 11-byte names which each contain a terminator.
+terminated_names = re.compile(b'(?:(?=.{0,10}\x50).{11})*', re.DOTALL)
+
+
+def _check_names(problems, data, offset, count, field):
+    if not terminated_names.fullmatch(data, offset, offset + 11*count):
+        problems.append((field, "a name has no terminator"))
+
+
+PokemonListLayout = namedtuple("PokemonListLayout", [
+    "key", "count", "species", "records", "record_size", "names", "ot_names",
+    "capacity", "strict", "box"])
+
+
+def _pokemon_list_layout(key, list_fields, record_reader, capacity, strict, box):
+    offset = save_file_fields[key][0]
+    return PokemonListLayout(key, offset, offset + list_fields['species'][0],
+                             offset + list_fields['pokemon'][0], record_reader.struct.size,
+                             offset + list_fields['names'][0], offset + list_fields['ot_names'][0],
+                             capacity, strict, box)
+
+
+# Boxes the game has never switched to are not initialized; the parser reads
+# them as empty, so only the team and current box must have a valid count.
+# The parser also reads a box with a count of 0 as empty without looking at
+# the rest of it, so nothing else is checked for those; the team has no such
+# shortcut.
+pokemon_list_layouts = (
+    [_pokemon_list_layout('team_pokemon', team_pokemon_fields, pokemon_full_reader, 6, True, False),
+     _pokemon_list_layout('current_box_pokemon', pc_box_fields, pokemon_brief_reader, 20, True, True)] +
+    [_pokemon_list_layout('pc_box_{}'.format(n), pc_box_fields, pokemon_brief_reader, 20, False, True)
+     for n in range(1, 13)])
+
+
+def _check_pokemon_list(problems, data, layout):
+    key, offset, species, records, record_size, names, ot_names, capacity, strict, box = layout
+    count = data[offset]
+    if count > capacity:
+        if strict:
+            problems.append((key, "count {} is over {}".format(count, capacity)))
+        return
+    if count == 0 and box:
+        return
+    if data[species + count] != 0xff:
+        problems.append((key, "species list is not terminated"))
+    if data[species:species + count].translate(None, species_indices):
+        problems.append((key, "species list has an unknown species"))
+    if data[species:species + capacity].translate(None, not_missingno):
+        problems.append((key, "species list has an index with no Pokemon"))
+    if data[records:records + record_size*count:record_size].translate(None, species_indices):
+        problems.append((key, "a Pokemon has an unknown species"))
+    _check_names(problems, data, names, count, key)
+    _check_names(problems, data, ot_names, count, key)
+
+
+def _pokemon_lists_valid(data):
+    # The checks of _check_pokemon_list, with the slices of every list joined
+    # so that each check runs once for the whole save.
+    species_lists = []
+    missingno_lists = []
+    record_species = []
+    name_lists = []
+    for key, offset, species, records, record_size, names, ot_names, capacity, strict, box in pokemon_list_layouts:
+        count = data[offset]
+        if count > capacity:
+            if strict:
+                return False
+            continue
+        if count == 0 and box:
+            continue
+        if data[species + count] != 0xff:
+            return False
+        species_lists.append(data[species:species + count])
+        missingno_lists.append(data[species:species + capacity])
+        record_species.append(data[records:records + record_size*count:record_size])
+        name_lists.append(data[names:names + 11*count])
+        name_lists.append(data[ot_names:ot_names + 11*count])
+    return not (b''.join(species_lists + record_species).translate(None, species_indices) or
+                b''.join(missingno_lists).translate(None, not_missingno) or
+                not terminated_names.fullmatch(b''.join(name_lists)))
+
+
+def _check_item_list(problems, data, key):
+    offset, st = save_file_fields[key]
+    capacity = (st.size - 2) // 2
+    count = data[offset]
+    if count > capacity:
+        problems.append((key, "count {} is over {}".format(count, capacity)))
+        return
+    if data[offset + 1 + 2*count] != 0xff:
+        problems.append((key, "item list is not terminated"))
+    if data[offset + 1:offset + 1 + 2*count:2].translate(None, item_numbers):
+        problems.append((key, "item list has an unknown item"))
+
+
+def sniff_rby_us_save(data):
+    """Cheaply check whether data looks like a Red/Blue/Yellow save.
+
+    Checks the length, the main checksum, the options, the counts, species
+    and names of the team and boxes, the item lists and the player and rival
+    names.
+    Returns a SaveCheck of valid and a list of (field, problem) pairs; a
+    save which passes should not fail to decode.
+
+    """
+    data = bytes(data)
+    if len(data) != save_file_reader.struct.size:
+        return SaveCheck(False, [('length', "expected {} bytes, got {}".format(
+            save_file_reader.struct.size, len(data)))])
+    problems = []
+    if data[0x3523] != rby_us_checksum(data):
+        problems.append(('checksum', "main checksum does not match"))
+    for key in ('player_name', 'rival_name'):
+        _check_names(problems, data, save_file_fields[key][0], 1, key)
+    try:
+        parse_options(data[save_file_fields['options'][0]])
+    except ValueError as e:
+        problems.append(('options', str(e)))
+    if not _pokemon_lists_valid(data):
+        # Something is wrong; go through the lists one by one to say what.
+        for layout in pokemon_list_layouts:
+            _check_pokemon_list(problems, data, layout)
+    for key in ('pocket_item_list', 'pc_item_list'):
+        _check_item_list(problems, data, key)
+    return SaveCheck(not problems, problems)
+
+
+def repair_rby_us_checksums(b, banks=(0, 1)):
+    """Recompute the main checksum and the checksums of banks in bytearray b."""
+    b[0x3523] = rby_us_checksum(b)
+    for bank in banks:
+        for offset, value in rby_us_bank_checksums(b, bank):
+            b[offset] = value
+    return b
+
 
 def unparse_rby_us_save(s):
-    b = save_file_reader.pack(s)
-    checksum = (255 - sum(b[0x2598:0x3523])) & 255
-    s['checksum'] = checksum
-    return save_file_reader.pack(s)
+    if isinstance(s, LazySave):
+        b = s.pack()
+        # Leave checksums alone if nothing they cover has changed. As in
+        # changed_regions, bytes compare much faster than memoryviews.
+        old = bytes(s.data)
+        new = bytes(b)
+        banks = [bank for bank, start in enumerate(box_bank_offsets)
+                 if new[start:start + 6 * box_size] != old[start:start + 6 * box_size]]
+        if new[0x2598:0x3523] != old[0x2598:0x3523]:
+            b[0x3523] = rby_us_checksum(b)
+        for bank in banks:
+            for offset, value in rby_us_bank_checksums(b, bank):
+                b[offset] = value
+        return bytes(b)
+    return bytes(repair_rby_us_checksums(bytearray(save_file_reader.pack(s))))
+
+def changed_regions(old, new, block=512):
+    """Return (offset, bytes) runs of new which differ from old.
+
+    The data is compared in aligned blocks, and adjacent changed blocks are
+    merged into one run. Anything past the end of old counts as changed.
+
+    """
+    # Compare bytes rather than memoryviews: slices of bytes compare with a
+    # single memcmp, where memoryviews compare element by element.
+    old = bytes(old)
+    new = bytes(new)
+    regions = []
+    start = None
+    for offset in range(0, len(new), block):
+        if new[offset:offset + block] != old[offset:offset + block]:
+            if start is None:
+                start = offset
+        elif start is not None:
+            regions.append((start, new[start:offset]))
+            start = None
+    if start is not None:
+        regions.append((start, new[start:]))
+    return regions
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_directory(path):
+    # Directories can only be opened and synced like this on POSIX.
+    if os.name == 'posix':
+        _fsync_path(os.path.dirname(os.path.abspath(path)))
+
+
+class SaveWriter(object):
+    """Writes files with a choice of method and durability.
+
+    method is one of:
+
+    * 'overwrite': truncate the file and write it, as write_rby_us_save
+      always used to.
+    * 'atomic': write a temporary file in the same directory and rename it
+      over the target, so the target is always either the old or the new
+      file.
+    * 'in_place': compare with the existing file and rewrite only the blocks
+      which changed, with os.pwrite. Not atomic, but much less I/O when most
+      of a save is unchanged.
+
+    sync is 'file' to fsync each file as it is written, 'batch' to fsync
+    everything once in flush() or close(), or None to leave it to the OS. With
+    'atomic' and 'batch', renames are delayed until flush(), so that each file
+    is durable before it replaces its target.
+
+    """
+    def __init__(self, method='atomic', sync='file'):
+        if method not in ('overwrite', 'atomic', 'in_place'):
+            raise ValueError("unknown method {!r}".format(method))
+        if sync not in ('file', 'batch', None):
+            raise ValueError("unknown sync policy {!r}".format(sync))
+        self.method = method
+        self.sync = sync
+        self._unsynced = []
+        self._renames = []
+        self._tmp_counter = itertools.count()
+
+    def write(self, data, path):
+        """Write the bytes in data to path."""
+        if self.method == 'in_place' and os.path.exists(path):
+            self._patch(data, path)
+        elif self.method == 'atomic':
+            self._write_atomic(data, path)
+            return
+        else:
+            with open(path, 'wb') as f:
+                f.write(data)
+                if self.sync == 'file':
+                    f.flush()
+                    os.fsync(f.fileno())
+        if self.sync == 'batch':
+            self._unsynced.append(path)
+
+    def _patch(self, data, path):
+        with open(path, 'r+b', buffering=0) as f:
+            old = f.read()
+            fd = f.fileno()
+            for offset, chunk in changed_regions(old, data):
+                if hasattr(os, 'pwrite'):
+                    os.pwrite(fd, chunk, offset)
+                else:
+                    f.seek(offset)
+                    f.write(chunk)
+            if len(old) > len(data):
+                f.truncate(len(data))
+            if self.sync == 'file':
+                os.fsync(fd)
+
+    def _write_atomic(self, data, path):
+        directory, name = os.path.split(os.path.abspath(path))
+        tmp = os.path.join(directory, '.{}.{}.{}.tmp'.format(
+            name, os.getpid(), next(self._tmp_counter)))
+        # Keep the permissions of the file being replaced.
+        mode = os.stat(path).st_mode & 0o7777 if os.path.exists(path) else 0o666
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), mode)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                if self.sync == 'file':
+                    f.flush()
+                    os.fsync(f.fileno())
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        if self.sync == 'batch':
+            self._unsynced.append(tmp)
+            self._renames.append((tmp, path))
+        else:
+            os.replace(tmp, path)
+            if self.sync == 'file':
+                _fsync_directory(path)
+
+    def flush(self):
+        """Make everything written so far durable (with sync='batch')."""
+        for path in self._unsynced:
+            _fsync_path(path)
+        directories = set()
+        for tmp, path in self._renames:
+            os.replace(tmp, path)
+            directories.add(os.path.dirname(os.path.abspath(path)))
+        for path in self._unsynced:
+            directories.add(os.path.dirname(os.path.abspath(path)))
+        if os.name == 'posix':
+            for directory in directories:
+                _fsync_path(directory)
+        self._unsynced = []
+        self._renames = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't replace anything with the results of a failed batch.
+            discarded = set()
+            for tmp, path in self._renames:
+                os.unlink(tmp)
+                discarded.add(tmp)
+            self._unsynced = [path for path in self._unsynced if path not in discarded]
+            self._renames = []
 
-def write_rby_us_save(s, path):
+
+def write_rby_us_save(s, path, method='overwrite', sync=None):
+    """Write a save to path; see SaveWriter for method and sync."""
     data = unparse_rby_us_save(s)
-    with open(path, 'wb') as f:
-        f.write(data)
+    with SaveWriter(method, sync) as writer:
+        writer.write(data, path)
+
+
+class Change(namedtuple("Change", ["path", "old", "new"])):
+    """One difference between two saves.
+
+    path is a tuple of field names, list indices and Pokedex entries, e.g.
+    ('pc_box_3', 4, 'level_in_box'). old is None for something added, and
+    new is None for something removed.
+
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        path = ''.join('[{}]'.format(p) if type(p) is int else '.{}'.format(getattr(p, 'name', p))
+                       for p in self.path)
+        return "{}: {!r} -> {!r}".format(path.lstrip('.'), self.old, self.new)
+
+
+def _diff_values(changes, path, old, new):
+    if old == new:
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            _diff_values(changes, path + (key,), old[key], new.get(key))
+        for key in new:
+            if key not in old:
+                changes.append(Change(path + (key,), None, new[key]))
+    elif (isinstance(old, list) and isinstance(new, list)
+          and all(isinstance(v, dict) for v in itertools.chain(old, new))):
+        for i in range(max(len(old), len(new))):
+            _diff_values(changes, path + (i,),
+                         old[i] if i < len(old) else None,
+                         new[i] if i < len(new) else None)
+    else:
+        changes.append(Change(path, old, new))
+
+
+def _diff_pokemon_list(changes, key, old, new, list_fields, record_reader, record_fields, capacity):
+    offset = save_file_fields[key][0]
+    counts = [_list_count(view, offset, list_fields, capacity) for view in (old, new)]
+    arrays = _list_arrays(offset, list_fields, record_reader)
+
+    def pokemon(view, slot):
+        return _parse_slot(view, arrays, record_reader, record_fields, slot)
+
+    for slot in range(max(counts)):
+        if slot >= counts[0]:
+            changes.append(Change((key, slot), None, pokemon(new, slot)))
+        elif slot >= counts[1]:
+            changes.append(Change((key, slot), pokemon(old, slot), None))
+        elif any(old[start + n*slot:start + n*(slot+1)] != new[start + n*slot:start + n*(slot+1)]
+                 for start, n in arrays):
+            _diff_values(changes, (key, slot), pokemon(old, slot), pokemon(new, slot))
+
+
+def diff_rby_us_saves(old, new):
+    """Return a list of Changes from the save data old to the save data new.
+
+    The raw data is compared field by field, and only the fields which differ
+    are decoded; for the team and boxes, only the Pokemon which differ. The
+    main checksum is ignored, and changes to the unknown fields (which hold
+    the box bank checksums, among other things) are reported as raw bytes at
+    (field, offset).
+
+    """
+    # Comparing bytes is a memcmp; comparing memoryviews goes byte by byte.
+    old = bytes(old)
+    new = bytes(new)
+    for data in (old, new):
+        if len(data) != save_file_reader.struct.size:
+            raise struct.error("unpack requires a buffer of {} bytes".format(
+                save_file_reader.struct.size))
+    if old == new:
+        return []
+    changes = []
+    for key, (offset, st) in save_file_fields.items():
+        if key == 'checksum' or old[offset:offset + st.size] == new[offset:offset + st.size]:
+            continue
+        if key == 'team_pokemon':
+            _diff_pokemon_list(changes, key, old, new, team_pokemon_fields,
+                               pokemon_full_reader, pokemon_full_fields, 6)
+        elif key == 'current_box_pokemon' or key.startswith('pc_box_'):
+            _diff_pokemon_list(changes, key, old, new, pc_box_fields,
+                               pokemon_brief_reader, pokemon_brief_fields, 20)
+        elif key.startswith('unknown'):
+            for start, data in changed_regions(old[offset:offset + st.size],
+                                               new[offset:offset + st.size], 16):
+                changes.append(Change((key, start), old[offset + start:offset + start + len(data)], data))
+        else:
+            _diff_values(changes, (key,), unpack_field(save_file_reader, save_file_fields, old, key),
+                         unpack_field(save_file_reader, save_file_fields, new, key))
+    return changes
+
+
+DecodeResult = namedtuple("DecodeResult", ["index", "save", "error"])
+
+
+def _load_save(source, lazy=False, compact=False):
+    if isinstance(source, bytes):
+        return parse_rby_us_save(source, lazy, compact)
+    return read_rby_us_save(source, lazy, compact)
+
+
+def _decode_chunk(chunk, fields, compact=False):
+    results = []
+    for index, source in chunk:
+        try:
+            save = _load_save(source, lazy=fields is not None, compact=compact)
+            if fields is not None:
+                save = {k: save[k] for k in fields}
+            results.append(DecodeResult(index, save, None))
+        except Exception as e:
+            results.append(DecodeResult(index, None, e))
+    return results
+
+
+def _chunks(sources, size):
+    it = enumerate(bytes(s) if isinstance(s, (bytearray, memoryview)) else s
+                   for s in sources)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def map_chunks(executor, fn, chunks, window, ordered=True):
+    """Yield fn(chunk) for each chunk, run in executor.
+
+    At most window chunks are submitted at a time, and more are taken from
+    chunks only as results come back, so chunks may be a long or lazy
+    iterable. Results are yielded in order if ordered is true, otherwise as
+    they complete.
+
+    """
+    chunks = iter(chunks)
+    pending = collections.deque(executor.submit(fn, chunk)
+                                for chunk in itertools.islice(chunks, window))
+    while pending:
+        if ordered:
+            job = pending.popleft()
+        else:
+            done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            job = done.pop()
+            pending.remove(job)
+        result = job.result()
+        for chunk in itertools.islice(chunks, 1):
+            pending.append(executor.submit(fn, chunk))
+        yield result
+
+
+def decode_many(sources, workers=None, chunksize=16, ordered=True, fields=None,
+                compact=False):
+    """Decode many saves in a process pool.
+
+    sources may mix paths and buffers. Yields a DecodeResult for each source,
+    in input order if ordered is true, otherwise as chunks complete. Errors
+    are returned in the result rather than raised.
+
+    If fields is given, only those fields are decoded and sent back, which
+    is much cheaper than returning whole saves between processes. If compact
+    is true, saves are decoded as by parse_rby_us_save(data, compact=True),
+    which also pickles to about half the size.
+
+    Sources are read as they are needed, with about two chunks per worker in
+    flight; closing the generator early cancels the chunks not yet started.
+
+    """
+    if fields is not None:
+        fields = tuple(fields)
+    workers = workers or os.cpu_count() or 1
+    executor = futures.ProcessPoolExecutor(max_workers=workers)
+    try:
+        for results in map_chunks(executor, functools.partial(_decode_chunk, fields=fields, compact=compact),
+                                  _chunks(sources, chunksize), 2 * workers, ordered):
+            for result in results:
+                yield result
+    finally:
+        executor.shutdown(cancel_futures=True)
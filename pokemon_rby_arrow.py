@@ -0,0 +1,265 @@
+# Classic Game Resource Reader (CGRR): Parse resources from classic games.
+# Copyright (C) 2016  Tracy Poff
+#
+# This file is part of CGRR.
+#
+# CGRR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CGRR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CGRR.  If not, see <http://www.gnu.org/licenses/>.
+"""Exports Pokemon Red/Blue/Yellow saves to Apache Arrow and Parquet.
+
+Requires numpy and pyarrow. Saves are decoded in batches with
+pokemon_rby_columnar into three tables:
+
+* trainers: one row per save
+* pokemon: one row per Pokemon in the team, the current box and PC boxes 1-12
+* items: one row per item in the bag and the PC
+
+Every row carries the index of its save in the input. Species, moves, types
+and items are dictionary-encoded with the names of the enums in common.
+
+"""
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from . import pokemon_rby as pr
+from . import pokemon_rby_columnar as pc
+from .common import Pokemon, PokemonType, Move, Item
+
+
+def enum_dictionary(enum):
+    """Return (dictionary, valid) for dictionary-encoding enum values.
+
+    dictionary holds the member names indexed by value, and valid says which
+    values are members. Other values are stored as nulls, so the empty names
+    filling the gaps in dictionary are never referenced.
+
+    """
+    size = max(e.value for e in enum) + 1
+    names = [''] * size
+    valid = np.zeros(size, dtype=bool)
+    for e in enum:
+        names[e.value] = e.name
+        valid[e.value] = True
+    return pa.array(names, pa.string()), valid
+
+
+dictionaries = {enum: enum_dictionary(enum) for enum in (Pokemon, PokemonType, Move, Item)}
+
+locations = pa.array(['team', 'current_box', 'pc_box'], pa.string())
+item_locations = pa.array(['pocket', 'pc'], pa.string())
+
+
+def enum_column(codes, enum):
+    dictionary, valid = dictionaries[enum]
+    codes = codes.astype(np.int16)
+    missing = codes >= len(valid)
+    missing[~missing] = ~valid[codes[~missing]]
+    return pa.DictionaryArray.from_arrays(pa.array(codes, pa.int16(), mask=missing), dictionary)
+
+
+def location_column(n, location, dictionary):
+    code = dictionary.to_pylist().index(location)
+    return pa.DictionaryArray.from_arrays(pa.array(np.full(n, code, np.int8)), dictionary)
+
+
+trainer_schema = pa.schema([
+    ('save', pa.int64()),
+    ('player_name', pa.string()),
+    ('rival_name', pa.string()),
+    ('player_trainer_id', pa.uint16()),
+    ('money', pa.uint32()),
+    ('casino_coins', pa.uint16()),
+    ('badges', pa.uint8()),
+    ('badge_count', pa.uint8()),
+    ('pokedex_owned', pa.uint16()),
+    ('pokedex_seen', pa.uint16()),
+    ('time_played', pa.duration('s')),
+    ('current_pc_box', pa.uint8()),
+    ('pikachu_friendship', pa.uint8()),
+])
+
+pokemon_enum_fields = {
+    'species': Pokemon,
+    'type_1': PokemonType,
+    'type_2': PokemonType,
+    'move_1': Move,
+    'move_2': Move,
+    'move_3': Move,
+    'move_4': Move,
+}
+
+pokemon_schema = pa.schema([
+    ('save', pa.int64()),
+    ('location', pa.dictionary(pa.int8(), pa.string())),
+    ('box', pa.uint8()),
+    ('slot', pa.uint8()),
+    ('species', pa.dictionary(pa.int16(), pa.string())),
+    ('name', pa.string()),
+    ('ot_name', pa.string()),
+    ('original_trainer_id', pa.uint16()),
+    ('level_in_box', pa.uint8()),
+    ('current_hp', pa.uint16()),
+    ('status_condition', pa.uint8()),
+    ('type_1', pa.dictionary(pa.int16(), pa.string())),
+    ('type_2', pa.dictionary(pa.int16(), pa.string())),
+    ('catch_rate', pa.uint8()),
+    ('move_1', pa.dictionary(pa.int16(), pa.string())),
+    ('move_2', pa.dictionary(pa.int16(), pa.string())),
+    ('move_3', pa.dictionary(pa.int16(), pa.string())),
+    ('move_4', pa.dictionary(pa.int16(), pa.string())),
+    ('move_1_pp', pa.uint8()),
+    ('move_2_pp', pa.uint8()),
+    ('move_3_pp', pa.uint8()),
+    ('move_4_pp', pa.uint8()),
+    ('experience_points', pa.uint32()),
+    ('hp_ev', pa.uint16()),
+    ('attack_ev', pa.uint16()),
+    ('defense_ev', pa.uint16()),
+    ('speed_ev', pa.uint16()),
+    ('special_ev', pa.uint16()),
+    ('iv_attack', pa.uint8()),
+    ('iv_defense', pa.uint8()),
+    ('iv_speed', pa.uint8()),
+    ('iv_special', pa.uint8()),
+    # Only stored for Pokemon in the team.
+    ('level', pa.uint8()),
+    ('maximum_hp', pa.uint16()),
+    ('attack', pa.uint16()),
+    ('defense', pa.uint16()),
+    ('speed', pa.uint16()),
+    ('special', pa.uint16()),
+])
+
+item_schema = pa.schema([
+    ('save', pa.int64()),
+    ('location', pa.dictionary(pa.int8(), pa.string())),
+    ('slot', pa.uint8()),
+    ('item', pa.dictionary(pa.int16(), pa.string())),
+    ('count', pa.uint8()),
+])
+
+
+def trainer_batch(data, first_save=0):
+    columns = pc.save_trainer_columns(data)
+    columns['save'] = columns['save'] + first_save
+    columns['time_played'] = columns['time_played'].astype('timedelta64[s]')
+    return pa.RecordBatch.from_arrays(
+        [pa.array(columns[f.name], f.type) for f in trainer_schema], schema=trainer_schema)
+
+
+def _pokemon_batch(columns, location, first_save):
+    n = len(columns['save'])
+    columns['save'] = columns['save'] + first_save
+    columns.setdefault('box', np.zeros(n, np.uint8))
+    arrays = []
+    for f in pokemon_schema:
+        if f.name == 'location':
+            arrays.append(location_column(n, location, locations))
+        elif f.name in pokemon_enum_fields:
+            arrays.append(enum_column(columns[f.name], pokemon_enum_fields[f.name]))
+        elif f.name in columns:
+            arrays.append(pa.array(columns[f.name], f.type))
+        else:
+            arrays.append(pa.nulls(n, f.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=pokemon_schema)
+
+
+def pokemon_batches(data, first_save=0):
+    """Return record batches for the team, current box and PC boxes of data.
+
+    'box' is 0 for the team, and the box number for the current box.
+
+    """
+    current = pc.save_current_box_columns(data)
+    current['box'] = (pc.save_region(data, 'current_pc_box', 'u1') & 0x0F)[current['save']] + 1
+    return [
+        _pokemon_batch(pc.save_team_columns(data), 'team', first_save),
+        _pokemon_batch(current, 'current_box', first_save),
+        _pokemon_batch(pc.save_box_columns(data), 'pc_box', first_save),
+    ]
+
+
+def item_batches(data, first_save=0):
+    batches = []
+    for key, location in (('pocket_item_list', 'pocket'), ('pc_item_list', 'pc')):
+        columns = pc.save_item_columns(data, key)
+        n = len(columns['save'])
+        batches.append(pa.RecordBatch.from_arrays([
+            pa.array(columns['save'] + first_save, pa.int64()),
+            location_column(n, location, item_locations),
+            pa.array(columns['slot'], pa.uint8()),
+            enum_column(columns['item'], Item),
+            pa.array(columns['count'], pa.uint8()),
+        ], schema=item_schema))
+    return batches
+
+
+def _batched_saves(saves, batch_size):
+    batch = bytearray()
+    count = 0
+    for save in saves:
+        if not isinstance(save, (bytes, bytearray, memoryview)):
+            with open(save, 'rb') as f:
+                save = f.read(pr.SaveArchive.save_size)
+        if len(save) != pr.SaveArchive.save_size:
+            raise ValueError("saves must be {} bytes".format(pr.SaveArchive.save_size))
+        batch += save
+        count += 1
+        if count == batch_size:
+            yield batch
+            batch = bytearray()
+            count = 0
+    if count:
+        yield batch
+
+
+def record_batches(saves, batch_size=1024):
+    """Decode saves (paths or buffers) in batches.
+
+    Yields (trainers, pokemon, items) for each batch, where trainers is a
+    record batch and pokemon and items are lists of record batches.
+
+    """
+    first_save = 0
+    for data in _batched_saves(saves, batch_size):
+        yield (trainer_batch(data, first_save),
+               pokemon_batches(data, first_save),
+               item_batches(data, first_save))
+        first_save += pc.save_count(data)
+
+
+def write_parquet(saves, directory, batch_size=1024, **kwargs):
+    """Write trainers.parquet, pokemon.parquet and items.parquet to directory.
+
+    Extra keyword arguments are passed to pyarrow.parquet.ParquetWriter.
+
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    writers = [pq.ParquetWriter(os.path.join(directory, name), schema, **kwargs)
+               for name, schema in (('trainers.parquet', trainer_schema),
+                                    ('pokemon.parquet', pokemon_schema),
+                                    ('items.parquet', item_schema))]
+    try:
+        for trainers, pokemon, items in record_batches(saves, batch_size):
+            writers[0].write_batch(trainers)
+            for batch in pokemon:
+                writers[1].write_batch(batch)
+            for batch in items:
+                writers[2].write_batch(batch)
+    finally:
+        for writer in writers:
+            writer.close()
@@ -0,0 +1,66 @@
+# Classic Game Resource Reader (CGRR): Parse resources from classic games.
+# Copyright (C) 2016  Tracy Poff
+#
+# This file is part of CGRR.
+#
+# CGRR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CGRR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CGRR.  If not, see <http://www.gnu.org/licenses/>.
+"""Asyncio versions of the Pokemon Red/Blue/Yellow save reader and writer.
+
+    >>> from pokemon import pokemon_rby_async as pra
+    >>> save = await pra.read_rby_us_save('red.sav')
+    >>> await pra.write_rby_us_save(save, 'edited.sav')
+
+Files are read and written in the event loop's default executor, so the loop
+is never blocked on disk. Decoding and encoding run in the executor passed as
+executor, which may be a ThreadPoolExecutor or a ProcessPoolExecutor; if it is
+None, the loop's default executor is used for those too. With a process pool
+the decode does not hold the GIL of the event loop's process at all.
+
+"""
+import asyncio
+
+from . import pokemon_rby as pr
+
+
+def _read(path):
+    with open(path, 'rb') as savefile:
+        return savefile.read(32768)
+
+
+def _write(data, path, method, sync):
+    with pr.SaveWriter(method, sync) as writer:
+        writer.write(data, path)
+
+
+async def parse_rby_us_save(data, lazy=False, compact=False, executor=None):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, pr.parse_rby_us_save, bytes(data), lazy, compact)
+
+
+async def unparse_rby_us_save(s, executor=None):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, pr.unparse_rby_us_save, s)
+
+
+async def read_rby_us_save(path, lazy=False, compact=False, executor=None):
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(None, _read, path)
+    return await parse_rby_us_save(data, lazy, compact, executor)
+
+
+async def write_rby_us_save(s, path, executor=None, method='overwrite', sync=None):
+    """Write a save to path; see pokemon_rby.SaveWriter for method and sync."""
+    data = await unparse_rby_us_save(s, executor)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _write, data, path, method, sync)
@@ -0,0 +1,134 @@
+# Classic Game Resource Reader (CGRR): Parse resources from classic games.
+# Copyright (C) 2016  Tracy Poff
+#
+# This file is part of CGRR.
+#
+# CGRR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CGRR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CGRR.  If not, see <http://www.gnu.org/licenses/>.
+"""A persistent cache of decoded Pokemon Red/Blue/Yellow saves.
+
+    >>> from pokemon.pokemon_rby_cache import ParseCache
+    >>> cache = ParseCache('saves.db', max_size=2**30)
+    >>> save = cache.read_rby_us_save('red.sav')
+
+Results are stored in a sqlite database, keyed by the SHA-256 of the save
+data, and each call returns a fresh copy. The least recently used entries are
+evicted once the stored results exceed max_size bytes. Entries written by a
+different pokemon_rby.format_version are discarded when the cache is opened.
+
+"""
+import hashlib
+import pickle
+import sqlite3
+
+from . import pokemon_rby as pr
+
+
+class ParseCache(object):
+    def __init__(self, path, max_size=256 * 2**20):
+        self.max_size = max_size
+        self.db = sqlite3.connect(path, timeout=60)
+        # The cache can always be rebuilt, so durability is traded for speed.
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=OFF")
+        with self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS saves (
+                    key     TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    value   BLOB NOT NULL,
+                    size    INTEGER NOT NULL,
+                    used    INTEGER NOT NULL
+                )""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS saves_used ON saves (used)")
+            # The total size is kept up to date by triggers, so checking it
+            # on every insert doesn't have to scan the table.
+            self.db.execute("CREATE TABLE IF NOT EXISTS total (size INTEGER NOT NULL)")
+            if self.db.execute("SELECT COUNT(*) FROM total").fetchone()[0] == 0:
+                self.db.execute("INSERT INTO total SELECT COALESCE(SUM(size), 0) FROM saves")
+            self.db.execute("""
+                CREATE TRIGGER IF NOT EXISTS saves_insert AFTER INSERT ON saves BEGIN
+                    UPDATE total SET size = size + NEW.size;
+                END""")
+            self.db.execute("""
+                CREATE TRIGGER IF NOT EXISTS saves_delete AFTER DELETE ON saves BEGIN
+                    UPDATE total SET size = size - OLD.size;
+                END""")
+            self.db.execute("""
+                CREATE TRIGGER IF NOT EXISTS saves_update AFTER UPDATE OF size ON saves BEGIN
+                    UPDATE total SET size = size - OLD.size + NEW.size;
+                END""")
+            self.db.execute("DELETE FROM saves WHERE version != ?", (pr.format_version,))
+        self.hits = 0
+        self.misses = 0
+
+    def _tick(self):
+        return self.db.execute("SELECT COALESCE(MAX(used), 0) + 1 FROM saves").fetchone()[0]
+
+    def parse_rby_us_save(self, data, compact=False):
+        """Like pokemon_rby.parse_rby_us_save, but stored in the cache."""
+        key = hashlib.sha256(data).hexdigest() + (':compact' if compact else '')
+        row = self.db.execute("SELECT value FROM saves WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self.hits += 1
+            with self.db:
+                self.db.execute("UPDATE saves SET used = ? WHERE key = ?", (self._tick(), key))
+            return pickle.loads(row[0])
+        self.misses += 1
+        save = pr.parse_rby_us_save(data, compact=compact)
+        value = pickle.dumps(save, pickle.HIGHEST_PROTOCOL)
+        with self.db:
+            # Not INSERT OR REPLACE: the rows it replaces don't fire the
+            # delete trigger.
+            self.db.execute("""
+                INSERT INTO saves VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET version = excluded.version,
+                    value = excluded.value, size = excluded.size, used = excluded.used""",
+                            (key, pr.format_version, value, len(value), self._tick()))
+            self._evict()
+        return save
+
+    def read_rby_us_save(self, path, compact=False):
+        """Like pokemon_rby.read_rby_us_save, but stored in the cache."""
+        with open(path, 'rb') as savefile:
+            data = savefile.read(32768)
+        return self.parse_rby_us_save(data, compact)
+
+    def size(self):
+        return self.db.execute("SELECT size FROM total").fetchone()[0]
+
+    def _evict(self):
+        excess = self.size() - self.max_size
+        if excess <= 0:
+            return
+        freed = 0
+        keys = []
+        for key, size in self.db.execute("SELECT key, size FROM saves ORDER BY used"):
+            if freed >= excess:
+                break
+            keys.append((key,))
+            freed += size
+        self.db.executemany("DELETE FROM saves WHERE key = ?", keys)
+
+    def clear(self):
+        with self.db:
+            self.db.execute("DELETE FROM saves")
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
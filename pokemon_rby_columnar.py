@@ -0,0 +1,222 @@
+# Classic Game Resource Reader (CGRR): Parse resources from classic games.
+# Copyright (C) 2016  Tracy Poff
+#
+# This file is part of CGRR.
+#
+# CGRR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CGRR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CGRR.  If not, see <http://www.gnu.org/licenses/>.
+"""Decodes Pokemon Red/Blue/Yellow saves into NumPy columns.
+
+Requires numpy. Records are viewed in place with structured dtypes built from
+the readers in pokemon_rby, and each field is decoded for all Pokemon at
+once. Species are Pokedex numbers; moves, types and status are left as their
+raw values (0 for no move).
+
+"""
+import numpy as np
+
+from . import pokemon_rby as pr
+
+
+def reader_dtype(reader, overrides=None):
+    """Build a structured dtype matching the layout of a FileReader."""
+    overrides = overrides or {}
+    fields = []
+    for name, fmt in reader.format.items():
+        if name in overrides:
+            fields.append((name,) + tuple(overrides[name]))
+        elif fmt.endswith('s'):
+            fields.append((name, 'u1', (int(fmt[:-1] or 1),)))
+        else:
+            fields.append((name, reader.byte_order + {'B': 'u1', 'H': 'u2'}[fmt]))
+    dtype = np.dtype(fields)
+    assert dtype.itemsize == reader.struct.size
+    return dtype
+
+
+pokemon_brief_dtype = reader_dtype(pr.pokemon_brief_reader)
+pokemon_full_dtype = reader_dtype(pr.pokemon_full_reader)
+pc_box_dtype = reader_dtype(pr.pc_box_reader, {'pokemon': (pokemon_brief_dtype, (20,))})
+team_dtype = reader_dtype(pr.team_pokemon_reader, {'pokemon': (pokemon_full_dtype, (6,))})
+
+species_table = np.zeros(256, dtype=np.uint16)
+for i, n in pr.species_index.items():
+    species_table[i] = n
+del i, n
+
+
+def pokemon_columns(records):
+    """Decode a 1-d array of pokemon_brief_dtype or pokemon_full_dtype records."""
+    columns = {}
+    for name in records.dtype.names:
+        field = records[name]
+        if name == 'species':
+            columns[name] = species_table[field]
+        elif name == 'experience_points':
+            exp = field.astype(np.uint32)
+            columns[name] = (exp[:, 0] << 16) | (exp[:, 1] << 8) | exp[:, 2]
+        elif name == 'iv':
+            columns['iv_attack'] = field[:, 0] >> 4
+            columns['iv_defense'] = field[:, 0] & 0x0F
+            columns['iv_speed'] = field[:, 1] >> 4
+            columns['iv_special'] = field[:, 1] & 0x0F
+        else:
+            columns[name] = field.astype(field.dtype.newbyteorder('='))
+    return columns
+
+
+def decode_names(names):
+    """Decode an (n, 11) array of name fields to an array of str."""
+    text = names.tobytes().decode('pokemon_rby_us')
+    return np.array([text[i:i + 11].split('\u0003')[0] for i in range(0, len(text), 11)],
+                    dtype=object)
+
+
+def occupied_columns(lists, capacity):
+    """Decode the Pokemon in an array of boxes or teams of any shape.
+
+    Returns (index, columns), where index is a tuple of arrays giving the
+    position of each Pokemon in lists followed by its slot, as from
+    numpy.nonzero. A count over capacity is treated as an empty list, as in
+    parse_pc_box_pokemon.
+
+    """
+    counts = lists['count']
+    counts = np.where(counts > capacity, 0, counts)
+    occupied = np.arange(capacity) < counts[..., np.newaxis]
+    columns = pokemon_columns(lists['pokemon'][occupied])
+    shape = lists.shape + (capacity, 11)
+    columns['name'] = decode_names(lists['names'].reshape(shape)[occupied])
+    columns['ot_name'] = decode_names(lists['ot_names'].reshape(shape)[occupied])
+    return np.nonzero(occupied), columns
+
+
+def box_columns(boxes):
+    return occupied_columns(boxes, 20)
+
+
+def team_columns(teams):
+    return occupied_columns(teams, 6)
+
+
+def parse_pc_box_columns(b):
+    """Decode one 1122-byte PC box into columns, with a 'slot' column."""
+    (_, slot), columns = box_columns(np.frombuffer(b, pc_box_dtype, count=1))
+    columns['slot'] = slot
+    return columns
+
+
+def save_count(data):
+    return len(memoryview(data)) // pr.SaveArchive.save_size
+
+
+def save_region(data, key, dtype):
+    """View one field of each of the back-to-back saves in data as dtype."""
+    return np.ndarray(shape=(save_count(data),), dtype=dtype, buffer=data,
+                      offset=pr.save_file_fields[key][0], strides=(pr.SaveArchive.save_size,))
+
+
+def save_boxes(data):
+    """View PC boxes 1-12 of each of the back-to-back saves in data.
+
+    The result has shape (saves, 2, 6): the two box banks of each save, and
+    the six boxes in each bank. No data is copied.
+
+    """
+    bank_offset = pr.save_file_fields['pc_box_1'][0]
+    bank_stride = pr.save_file_fields['pc_box_7'][0] - bank_offset
+    return np.ndarray(shape=(save_count(data), 2, 6), dtype=pc_box_dtype, buffer=data,
+                      offset=bank_offset,
+                      strides=(pr.SaveArchive.save_size, bank_stride, pc_box_dtype.itemsize))
+
+
+def save_box_columns(data):
+    """Decode every Pokemon in PC boxes 1-12 of the saves in data.
+
+    Adds 'save' (the index of the save in data), 'box' (1-12) and 'slot'
+    columns.
+
+    """
+    (save, bank, box, slot), columns = box_columns(save_boxes(data))
+    columns['save'] = save
+    columns['box'] = bank * 6 + box + 1
+    columns['slot'] = slot
+    return columns
+
+
+def save_current_box_columns(data):
+    """Decode the current box of each save in data, with 'save' and 'slot'."""
+    (save, slot), columns = box_columns(save_region(data, 'current_box_pokemon', pc_box_dtype))
+    columns['save'] = save
+    columns['slot'] = slot
+    return columns
+
+
+def save_team_columns(data):
+    """Decode the team of each save in data, with 'save' and 'slot'."""
+    (save, slot), columns = team_columns(save_region(data, 'team_pokemon', team_dtype))
+    columns['save'] = save
+    columns['slot'] = slot
+    return columns
+
+
+def save_item_columns(data, key):
+    """Decode an item list field ('pocket_item_list' or 'pc_item_list').
+
+    Returns columns 'save', 'slot', 'item' and 'count'.
+
+    """
+    size = pr.save_file_fields[key][1].size
+    capacity = (size - 2) // 2
+    lists = save_region(data, key, np.dtype([('count', 'u1'), ('entries', 'u1', (capacity, 2)),
+                                             ('end', 'u1')]))
+    counts = np.minimum(lists['count'], capacity)
+    occupied = np.arange(capacity) < counts[..., np.newaxis]
+    save, slot = np.nonzero(occupied)
+    entries = lists['entries'][occupied]
+    return {'save': save, 'slot': slot, 'item': entries[:, 0], 'count': entries[:, 1]}
+
+
+def parse_bcd_columns(digits):
+    """Decode an (n, size) array of BCD bytes."""
+    total = np.zeros(len(digits), dtype=np.uint32)
+    for i in range(digits.shape[1]):
+        total = total * 100 + (digits[:, i] >> 4) * 10 + (digits[:, i] & 0x0F)
+    return total
+
+
+def save_trainer_columns(data):
+    """Decode the trainer information of each save in data, one row per save."""
+    def region(key, dtype='u1'):
+        return save_region(data, key, np.dtype((dtype, pr.save_file_fields[key][1].size)))
+
+    time_played = save_region(data, 'time_played',
+                              np.dtype([('hours', '<u2'), ('minutes', 'u1'), ('seconds', 'u1')]))
+    badges = save_region(data, 'badges', 'u1')
+    return {
+        'save': np.arange(save_count(data)),
+        'player_name': decode_names(region('player_name')),
+        'rival_name': decode_names(region('rival_name')),
+        'player_trainer_id': save_region(data, 'player_trainer_id', '>u2').astype(np.uint16),
+        'money': parse_bcd_columns(region('money')),
+        'casino_coins': parse_bcd_columns(region('casino_coins')),
+        'badges': badges.copy(),
+        'badge_count': np.unpackbits(badges[:, np.newaxis], axis=1).sum(axis=1),
+        'pokedex_owned': np.unpackbits(region('pokedex_owned'), axis=1).sum(axis=1),
+        'pokedex_seen': np.unpackbits(region('pokedex_seen'), axis=1).sum(axis=1),
+        'time_played': (time_played['hours'].astype(np.uint32) * 3600
+                        + time_played['minutes'].astype(np.uint32) * 60
+                        + time_played['seconds']),
+        'current_pc_box': (save_region(data, 'current_pc_box', 'u1') & 0x0F) + 1,
+        'pikachu_friendship': save_region(data, 'pikachu_friendship', 'u1').copy(),
+    }
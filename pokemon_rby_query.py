@@ -0,0 +1,251 @@
+# Classic Game Resource Reader (CGRR): Parse resources from classic games.
+# Copyright (C) 2016  Tracy Poff
+#
+# This file is part of CGRR.
+#
+# CGRR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CGRR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CGRR.  If not, see <http://www.gnu.org/licenses/>.
+"""Aggregate queries over many Pokemon Red/Blue/Yellow saves.
+
+A query is a set of named aggregates and optional filter conditions:
+
+    >>> from pokemon import pokemon_rby_query as q
+    >>> from pokemon.common import Pokemon
+    >>> q.query(paths, {
+    ...     'saves': q.Count(),
+    ...     'own_mew': q.Count(where=[('pokedex_owned', 'contains', Pokemon.Mew)]),
+    ...     'badges': q.Tally('badges'),
+    ...     'time_played': q.Mean('time_played'),
+    ... })
+
+Only the save fields named by the aggregates and conditions are decoded,
+using the lazy save from pokemon_rby with the compact Pokedex. The saves are
+split across a process pool, and partial results are merged at the end.
+
+Conditions are (field, op, value) tuples, where op is one of ==, !=, <, <=,
+>, >=, in, contains, or a function of (field value, value). With a process
+pool, functions must be picklable; pass workers=0 to run in this process.
+
+"""
+import collections
+import functools
+import operator
+import os
+from concurrent import futures
+
+from . import pokemon_rby as pr
+
+operators = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda a, b: a in b,
+    'contains': operator.contains,
+}
+
+
+def matches(save, conditions):
+    for field, op, value in conditions:
+        if not operators.get(op, op)(save[field], value):
+            return False
+    return True
+
+
+class Aggregate(object):
+    """Base class for aggregates. Subclasses combine the values of field."""
+    field = None
+
+    def __init__(self, where=()):
+        self.where = list(where)
+
+    def project(self, save):
+        """Return the value to add for save, which must not be changed by add."""
+        return save[self.field] if self.field else None
+
+    def initial(self):
+        raise NotImplementedError
+
+    def add(self, state, value):
+        raise NotImplementedError
+
+    def merge(self, a, b):
+        raise NotImplementedError
+
+    def result(self, state):
+        return state
+
+
+class Count(Aggregate):
+    def initial(self):
+        return 0
+
+    def add(self, state, value):
+        return state + 1
+
+    def merge(self, a, b):
+        return a + b
+
+
+class Sum(Aggregate):
+    def __init__(self, field, where=()):
+        super(Sum, self).__init__(where)
+        self.field = field
+
+    def initial(self):
+        return None
+
+    def add(self, state, value):
+        return value if state is None else state + value
+
+    def merge(self, a, b):
+        if a is None:
+            return b
+        return a if b is None else a + b
+
+
+class Mean(Sum):
+    def initial(self):
+        return (None, 0)
+
+    def add(self, state, value):
+        return (Sum.add(self, state[0], value), state[1] + 1)
+
+    def merge(self, a, b):
+        return (Sum.merge(self, a[0], b[0]), a[1] + b[1])
+
+    def result(self, state):
+        return state[0] / state[1] if state[1] else None
+
+
+class Min(Sum):
+    def add(self, state, value):
+        return value if state is None else min(state, value)
+
+    def merge(self, a, b):
+        if a is None:
+            return b
+        return a if b is None else min(a, b)
+
+
+class Max(Sum):
+    def add(self, state, value):
+        return value if state is None else max(state, value)
+
+    def merge(self, a, b):
+        if a is None:
+            return b
+        return a if b is None else max(a, b)
+
+
+class Distribution(Sum):
+    """Count how many saves have each value of field (or of key(value))."""
+    def __init__(self, field, key=None, where=()):
+        super(Distribution, self).__init__(field, where)
+        self.key = key
+
+    def project(self, save):
+        value = save[self.field]
+        if self.key is not None:
+            value = self.key(value)
+        if isinstance(value, (list, set, pr.Pokedex)):
+            value = tuple(value)
+        return value
+
+    def initial(self):
+        return collections.Counter()
+
+    def add(self, state, value):
+        state[value] += 1
+        return state
+
+    def merge(self, a, b):
+        a.update(b)
+        return a
+
+
+class Tally(Distribution):
+    """Count how many saves include each element of a collection field."""
+    def project(self, save):
+        value = save[self.field]
+        if self.key is not None:
+            value = self.key(value)
+        return list(value)
+
+    def add(self, state, value):
+        state.update(value)
+        return state
+
+
+QueryResult = collections.namedtuple("QueryResult", ["results", "scanned", "errors"])
+
+
+def _query_chunk(chunk, aggregates, where):
+    states = {name: a.initial() for name, a in aggregates}
+    errors = []
+    for index, source in chunk:
+        # Everything that can fail for this save happens before any
+        # aggregate is updated, so a save is either counted or an error.
+        try:
+            save = pr._load_save(source, lazy=True, compact=True)
+            if not matches(save, where):
+                continue
+            values = [(name, a, a.project(save)) for name, a in aggregates
+                      if matches(save, a.where)]
+        except Exception as e:
+            errors.append((index, e))
+            continue
+        for name, a, value in values:
+            states[name] = a.add(states[name], value)
+    return states, len(chunk), errors
+
+
+def query(sources, aggregates, where=(), workers=None, chunksize=64):
+    """Run aggregates over the saves in sources (paths or buffers).
+
+    aggregates maps names to Aggregate instances; where is a list of
+    conditions applied to every save. Returns a QueryResult of the
+    aggregate results by name, the number of saves scanned, and a list of
+    (index, exception) for saves which could not be read.
+
+    """
+    aggregates = list(aggregates.items())
+    where = list(where)
+    chunks = pr._chunks(sources, chunksize)
+
+    states = {name: a.initial() for name, a in aggregates}
+    scanned = 0
+    errors = []
+
+    def merge(partial):
+        for name, a in aggregates:
+            states[name] = a.merge(states[name], partial[0][name])
+        errors.extend(partial[2])
+        return partial[1]
+
+    run = functools.partial(_query_chunk, aggregates=aggregates, where=where)
+    if workers == 0:
+        for chunk in chunks:
+            scanned += merge(run(chunk))
+    else:
+        workers = workers or os.cpu_count() or 1
+        executor = futures.ProcessPoolExecutor(max_workers=workers)
+        try:
+            for partial in pr.map_chunks(executor, run, chunks, 2 * workers, ordered=False):
+                scanned += merge(partial)
+        finally:
+            executor.shutdown(cancel_futures=True)
+    results = {name: a.result(states[name]) for name, a in aggregates}
+    return QueryResult(results, scanned, sorted(errors, key=operator.itemgetter(0)))
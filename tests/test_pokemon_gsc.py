@@ -0,0 +1,110 @@
+# Classic Game Resource Reader (CGRR): Parse resources from classic games.
+# Copyright (C) 2016  Tracy Poff
+#
+# This file is part of CGRR.
+#
+# CGRR is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CGRR is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CGRR.  If not, see <http://www.gnu.org/licenses/>.
+"""Round trips of edited Pokemon Gold/Silver/Crystal saves."""
+import datetime
+import struct
+import unittest
+
+from .. import pokemon_gsc as g
+from .. import pokemon_rby as pr
+from ..common import Pokemon
+
+
+def pokemon(species, full, name='MON'):
+    p = {'species': species, 'held_item': 0, 'move_1': None, 'move_2': None,
+         'move_3': None, 'move_4': None, 'original_trainer_id': 1234,
+         'experience_points': 1000, 'hp_ev': 0, 'attack_ev': 0, 'defense_ev': 0,
+         'speed_ev': 0, 'special_ev': 0,
+         'iv': {'attack': 1, 'defense': 2, 'speed': 3, 'special': 4},
+         'move_1_pp': 0, 'move_2_pp': 0, 'move_3_pp': 0, 'move_4_pp': 0,
+         'friendship': 70, 'pokerus': 0, 'caught_data': 0, 'level': 10,
+         'name': name, 'ot_name': 'GOLD'}
+    if full:
+        p.update(status_condition=[], unused=0, current_hp=20, maximum_hp=20, attack=10,
+                 defense=10, speed=10, special_attack=10, special_defense=10)
+    return p
+
+
+def save(version, box):
+    reader = g.versions[version].reader
+    s = {key: bytes(struct.calcsize('>' + fmt)) for key, fmt in reader.format.items()
+         if key.startswith('unknown')}
+    s.update(options=bytes(8), player_trainer_id=1234, player_name='GOLD', rival_name='SILVER',
+             time_played=datetime.timedelta(hours=1), money=3000, johto_badges=[],
+             kanto_badges=[], tm_pocket=[0] * 57, item_pocket=[], key_item_pocket=[],
+             ball_pocket=[], pc_item_list=[], current_pc_box={'top_bit': 0, 'current_box': 1},
+             pc_box_names=['BOX{}'.format(n) for n in range(1, 15)],
+             team_pokemon={'pokemon': [pokemon(Pokemon.Cyndaquil, True)]},
+             pokedex_owned={Pokemon(i + 1): False for i in range(256)},
+             pokedex_seen={Pokemon(i + 1): False for i in range(256)},
+             checksum=0, current_box_pokemon={'pokemon': []})
+    if version == 'crystal':
+        s['player_gender'] = 0
+    for n in range(1, 15):
+        s['pc_box_{}'.format(n)] = {'pokemon': []}
+    s['pc_box_1'] = box
+    return s
+
+
+class EditRoundTripTest(unittest.TestCase):
+    def check_species(self, data, version, expected, records=None):
+        box = g.parse_gsc_us_save(data, version)['pc_box_1']
+        self.assertEqual(box['species'], expected)
+        self.assertEqual([p['species'] for p in box['pokemon']], records or expected)
+
+    def edit(self, version, compact, edit, expected):
+        box = {'pokemon': [pokemon(Pokemon.Chikorita, False), pokemon(Pokemon.Mew, False)]}
+        data = g.unparse_gsc_us_save(save(version, box), version)
+        s = g.parse_gsc_us_save(data, version, compact=compact)
+        edit(s['pc_box_1']['pokemon'])
+        data = g.unparse_gsc_us_save(s, version)
+        self.check_species(data, version, expected)
+        self.assertEqual(g.unparse_gsc_us_save(g.parse_gsc_us_save(data, version), version), data)
+
+    def test_edits(self):
+        def set_species(l):
+            l[0]['species'] = Pokemon.Totodile
+
+        def replace(l):
+            l[0] = pokemon(Pokemon.Pichu, False)
+
+        for version in ('gold_silver', 'crystal'):
+            for compact in (False, True):
+                self.edit(version, compact, set_species, [Pokemon.Totodile, Pokemon.Mew])
+                self.edit(version, compact, list.reverse, [Pokemon.Mew, Pokemon.Chikorita])
+                self.edit(version, compact, replace, [Pokemon.Pichu, Pokemon.Mew])
+
+    def test_eggs(self):
+        for version in ('gold_silver', 'crystal'):
+            box = {'pokemon': [pokemon(Pokemon.Togepi, False, 'EGG'), pokemon(Pokemon.Mew, False)]}
+            data = g.unparse_gsc_us_save(save(version, box), version)
+            # Mark the first Pokemon as an egg, as if it had been parsed as one.
+            s = g.parse_gsc_us_save(data, version)
+            s['pc_box_1']['eggs'] = [pr.pack_pokemon(g.pokemon_brief_reader, s['pc_box_1']['pokemon'][0])]
+            data = g.unparse_gsc_us_save(s, version)
+            self.check_species(data, version, [g.EGG, Pokemon.Mew], [Pokemon.Togepi, Pokemon.Mew])
+            # Eggs follow their record around the list, and are kept unchanged.
+            s = g.parse_gsc_us_save(data, version)
+            s['pc_box_1']['pokemon'].reverse()
+            data = g.unparse_gsc_us_save(s, version)
+            self.check_species(data, version, [Pokemon.Mew, g.EGG], [Pokemon.Mew, Pokemon.Togepi])
+            self.assertEqual(g.unparse_gsc_us_save(g.parse_gsc_us_save(data, version), version), data)
+
+
+if __name__ == '__main__':
+    unittest.main()